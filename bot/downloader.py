@@ -7,20 +7,102 @@ Last Modified: 2024-02-27
 """
 
 import os
+import re
 import time
 import shutil
-import subprocess
+import queue
+import functools
 import threading
+from dataclasses import dataclass
 from loguru import logger
 import yt_dlp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from .utils import get_temp_filepath, MAX_FILE_SIZE, TARGET_QUALITY
+from .utils import get_temp_filepath, MAX_FILE_SIZE, TARGET_QUALITY, SPEED_PROFILE, DOWNLOAD_DIR
 from .instagram_extractor import InstagramExtractor
 
 # Set a download timeout (in seconds)
 DOWNLOAD_TIMEOUT = 180  # 3 minutes
 
+# Telegram only fetches files up to 20MB when a video is sent by URL
+MAX_URL_UPLOAD_SIZE = 20 * 1024 * 1024
+
+# Platforms that get their own pool of persistent YoutubeDL instances
+YDL_PLATFORMS = ("youtube", "tiktok", "instagram", "vk", "default")
+
+# Number of downloads that can run at once, also the size of each platform's YoutubeDL pool
+DOWNLOAD_WORKERS = 8
+
+# Overrides for info-only instances: quiet, no download, don't resolve playlist entries
+_INFO_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'skip_download': True,
+    'extract_flat': 'in_playlist',
+    'socket_timeout': 10,
+}
+
+# Instagram post/reel path, used to build a canonical URL for yt-dlp
+_IG_URL_RE = re.compile(r'/(reel|p)/([^/?]+)')
+
+# yt-dlp error substrings mapped to error categories, checked in order
+_ERR_TABLE = (
+    ("video unavailable", "unavailable"),
+    ("not available in your country", "geo"),
+    ("ffmpeg is not installed", "ffmpeg"),
+    ("unable to download webpage", "network"),
+    ("http error", "network"),
+    ("unsupported url", "unsupported"),
+    ("sign in to confirm your age", "age"),
+    ("age-restricted", "age"),
+    ("private video", "private"),
+    ("login required", "login"),
+    ("requires authentication", "login"),
+    ("could not copy chrome cookie database", "cookies"),
+)
+
+# User-facing messages per (category, platform), platform None is the fallback
+_ERR_MESSAGES = {
+    ("unavailable", None): "This video is no longer available or is private.",
+    ("geo", None): "This video is geo-restricted and not available in the bot's region.",
+    ("ffmpeg", None): "FFmpeg is not properly installed. Please restart your terminal or install FFmpeg.",
+    ("network", None): "Network error while downloading. Please try again later.",
+    ("unsupported", None): "This URL is not supported. Please try a direct link to the video.",
+    ("age", None): "This video is age-restricted and cannot be downloaded.",
+    ("private", None): "This video is private and cannot be downloaded.",
+    ("login", "instagram"): "This Instagram content requires login. Try using a public Instagram video.",
+    ("login", "tiktok"): "This TikTok content requires login. Try using a public TikTok video.",
+    ("login", None): "This content requires login and cannot be downloaded.",
+    ("cookies", "instagram"): "Could not access Instagram content. Try using a different Instagram link format.",
+    ("cookies", "tiktok"): "Could not access TikTok content. Try using a different TikTok link format.",
+    ("cookies", None): "Could not access browser cookies. Try using a different link format.",
+}
+
+# Headers to mimic a browser for platforms that block bare clients
+_BROWSER_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+}
+
+# Referer sent along with the browser headers, per platform
+_REFERERS = {
+    "tiktok": 'https://www.tiktok.com/',
+    "instagram": 'https://www.instagram.com/',
+    "vk": 'https://vk.com/',
+}
+
+# Number of fragments fetched in parallel for HLS/DASH streams, per speed profile
+SPEED_PROFILES = {
+    "conservative": 3,
+    "balanced": 5,
+    "aggressive": 8,
+}
+
 # Try to find FFmpeg in common locations
+@functools.lru_cache(maxsize=1)
 def find_ffmpeg():
     """
     Try to find FFmpeg executable in common locations
@@ -29,17 +111,10 @@ def find_ffmpeg():
         str: Path to FFmpeg executable or None if not found
     """
     # Check if FFmpeg is in PATH
-    try:
-        result = subprocess.run(['ffmpeg', '-version'], 
-                               stdout=subprocess.PIPE, 
-                               stderr=subprocess.PIPE, 
-                               text=True, 
-                               shell=True)
-        if result.returncode == 0:
-            logger.info("FFmpeg found in PATH")
-            return 'ffmpeg'
-    except Exception:
-        pass
+    path = shutil.which('ffmpeg')
+    if path:
+        logger.info(f"FFmpeg found in PATH: {path}")
+        return path
     
     # Check common installation locations
     possible_paths = [
@@ -64,6 +139,13 @@ class DownloadTimeoutError(Exception):
     """Exception raised when download takes too long"""
     pass
 
+@dataclass
+class DownloadResult:
+    """Downloaded video file, its size and which downloader produced it ("ytdlp" or "instagram_custom")"""
+    path: str
+    size_bytes: int
+    source: str = "ytdlp"
+
 class VideoDownloader:
     """
     Class for downloading videos from supported platforms
@@ -83,18 +165,44 @@ class VideoDownloader:
             'writethumbnail': False,
             'socket_timeout': 30,  # Socket timeout in seconds
             'merge_output_format': 'mp4',  # Force output to be mp4
+            'retries': 3,
+            'fragment_retries': 3,
+            # Fetch HLS/DASH fragments in parallel instead of one by one
+            'concurrent_fragment_downloads': SPEED_PROFILES.get(SPEED_PROFILE, SPEED_PROFILES["balanced"]),
+            'http_chunk_size': 10 * 1024 * 1024,  # 10MB chunks for large progressive files
         }
         
         # Add FFmpeg location if found
         if FFMPEG_PATH:
             self.base_opts['ffmpeg_location'] = os.path.dirname(FFMPEG_PATH)
+        
+        # Platform-specific options are built once and reused for every download
+        self._platform_opts = {p: self._build_opts(p) for p in YDL_PLATFORMS}
             
+        # Shared HTTP session with keep-alive for the custom extractors
+        self._session = requests.Session()
+        self._session.mount("https://", HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=20,
+            max_retries=Retry(total=3, backoff_factor=0.3),
+        ))
+        
         # Initialize custom extractors
-        self.instagram_extractor = InstagramExtractor()
+        self.instagram_extractor = InstagramExtractor(session=self._session)
+        
+        # Pools of persistent YoutubeDL instances per platform, so HTTP connections are
+        # reused between downloads. YoutubeDL isn't reentrant, so an instance is only used
+        # by one download at a time; instances are created on demand up to DOWNLOAD_WORKERS.
+        self._ydl_pools = {p: queue.LifoQueue() for p in YDL_PLATFORMS}
+        self._ydl_counts = dict.fromkeys(YDL_PLATFORMS, 0)
+        # Separate pools of info-only instances, same format and headers as the downloads
+        self._info_pools = {p: queue.LifoQueue() for p in YDL_PLATFORMS}
+        self._info_counts = dict.fromkeys(YDL_PLATFORMS, 0)
+        self._ydl_pool_lock = threading.Lock()
     
-    def _get_platform_options(self, platform):
+    def _build_opts(self, platform):
         """
-        Get platform-specific download options
+        Build platform-specific download options
         
         Args:
             platform (str): Platform name (youtube, tiktok, instagram, vk)
@@ -107,86 +215,115 @@ class VideoDownloader:
         # Platform-specific format selection
         if platform == "youtube":
             opts['format'] = f'best[ext=mp4][height<={TARGET_QUALITY}]/bestvideo[ext=mp4][height<={TARGET_QUALITY}]+bestaudio[ext=m4a]/best[height<={TARGET_QUALITY}]'
-        elif platform == "tiktok":
-            # TikTok options without cookies
-            opts['format'] = 'best[ext=mp4]/best'
-            # Add custom headers to mimic a browser
-            opts['http_headers'] = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                'Accept-Language': 'en-US,en;q=0.5',
-                'Referer': 'https://www.tiktok.com/',
-            }
-            # Don't use cookies for TikTok
-            opts.pop('cookiesfrombrowser', None)
-        elif platform == "instagram":
-            # Instagram options without cookies
-            opts['format'] = 'best[ext=mp4]/best'
-            # Add custom headers to mimic a browser
-            opts['http_headers'] = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                'Accept-Language': 'en-US,en;q=0.5',
-                'Referer': 'https://www.instagram.com/',
-            }
-            # Don't use cookies for Instagram
-            opts.pop('cookiesfrombrowser', None)
-        elif platform == "vk":
-            # VK options without cookies
-            opts['format'] = 'best[ext=mp4]/best'
-            # Add custom headers to mimic a browser
-            opts['http_headers'] = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                'Accept-Language': 'en-US,en;q=0.5',
-                'Referer': 'https://vk.com/',
-            }
-            # Don't use cookies for VK
-            opts.pop('cookiesfrombrowser', None)
         else:
-            # Default format for other platforms
             opts['format'] = 'best[ext=mp4]/best'
         
+        # TikTok, Instagram and VK: mimic a browser and don't use cookies
+        if platform in _REFERERS:
+            opts['http_headers'] = {**_BROWSER_HEADERS, 'Referer': _REFERERS[platform]}
+            opts.pop('cookiesfrombrowser', None)
+        
         return opts
     
-    def _download_with_timeout(self, ydl, url):
+    def _get_platform_options(self, platform):
+        """
+        Get platform-specific download options
+        
+        Args:
+            platform (str): Platform name (youtube, tiktok, instagram, vk)
+            
+        Returns:
+            dict: Copy of the precomputed platform-specific options
+        """
+        return self._platform_opts.get(platform, self._platform_opts["default"]).copy()
+    
+    def _make_deadline_hook(self, state):
         """
-        Download with timeout using a separate thread
+        Create a yt-dlp progress hook that aborts the current download of an instance after its deadline
         
         Args:
-            ydl: YoutubeDL instance
-            url: URL to download
+            state (dict): Per-instance state holding the current download's deadline
             
         Returns:
-            dict: Video info or None if timeout
+            callable: Progress hook for yt-dlp
             
         Raises:
-            DownloadTimeoutError: If download times out
+            DownloadTimeoutError: From inside the hook once the deadline has passed
         """
-        result = {"info": None, "error": None}
+        def deadline_hook(d):
+            deadline = state['deadline']
+            if deadline is not None and time.monotonic() > deadline:
+                logger.error(f"Download timed out after {DOWNLOAD_TIMEOUT} seconds")
+                raise DownloadTimeoutError(f"Download timed out after {DOWNLOAD_TIMEOUT} seconds. Try again later or try a different video.")
         
-        def download_thread():
-            try:
-                result["info"] = ydl.extract_info(url, download=True)
-            except Exception as e:
-                result["error"] = e
+        return deadline_hook
+    
+    def _new_ydl(self, platform, info=False):
+        """
+        Create a persistent YoutubeDL instance for a platform
         
-        thread = threading.Thread(target=download_thread)
-        thread.daemon = True
-        thread.start()
+        Args:
+            platform (str): Key of the pool the instance belongs to
+            info (bool): Create an info-only instance instead of a downloading one
+            
+        Returns:
+            tuple: (YoutubeDL instance, its deadline state)
+        """
+        state = {'deadline': None}
+        opts = self._get_platform_options(platform)
+        if info:
+            opts.update(_INFO_OPTS)
+            return yt_dlp.YoutubeDL(opts), state
+        opts['outtmpl'] = os.path.join(DOWNLOAD_DIR, '%(id)s.%(ext)s')
+        # Abort from inside yt-dlp once the download runs past its deadline
+        opts['progress_hooks'] = [self._make_deadline_hook(state)]
+        return yt_dlp.YoutubeDL(opts), state
+    
+    def _acquire_ydl(self, platform, deadline, info=False):
+        """
+        Take a YoutubeDL instance from a platform's pool, creating one if the pool isn't full yet
+        
+        Args:
+            platform (str): Key of the pool to take the instance from
+            deadline (float): time.monotonic() value after which waiting is given up
+            info (bool): Take an info-only instance instead of a downloading one
+            
+        Returns:
+            tuple: (YoutubeDL instance, its deadline state)
+            
+        Raises:
+            DownloadTimeoutError: If no instance became free before the deadline
+        """
+        pools, counts = (self._info_pools, self._info_counts) if info else (self._ydl_pools, self._ydl_counts)
+        pool = pools[platform]
+        try:
+            return pool.get_nowait()
+        except queue.Empty:
+            pass
         
-        # Wait for the thread to complete or timeout
-        thread.join(DOWNLOAD_TIMEOUT)
+        with self._ydl_pool_lock:
+            if counts[platform] < DOWNLOAD_WORKERS:
+                counts[platform] += 1
+                return self._new_ydl(platform, info)
         
-        if thread.is_alive():
-            # Download is taking too long, raise timeout error
-            logger.error(f"Download timed out after {DOWNLOAD_TIMEOUT} seconds")
+        try:
+            return pool.get(timeout=max(0, deadline - time.monotonic()))
+        except queue.Empty:
+            logger.error(f"Download timed out after {DOWNLOAD_TIMEOUT} seconds waiting for a free downloader")
             raise DownloadTimeoutError(f"Download timed out after {DOWNLOAD_TIMEOUT} seconds. Try again later or try a different video.")
-        
-        if result["error"]:
-            raise result["error"]
-            
-        return result["info"]
+    
+    def close(self):
+        """
+        Close the persistent YoutubeDL instances and the shared HTTP session
+        """
+        for pool in (*self._ydl_pools.values(), *self._info_pools.values()):
+            while True:
+                try:
+                    ydl, _ = pool.get_nowait()
+                except queue.Empty:
+                    break
+                ydl.close()
+        self._session.close()
     
     def download_video(self, url, platform, video_id):
         """
@@ -198,7 +335,7 @@ class VideoDownloader:
             video_id (str): Video ID or full URL
             
         Returns:
-            str: Path to downloaded file or None if download failed
+            DownloadResult: Downloaded file path and size, or None if download failed
             
         Raises:
             ValueError: If file size exceeds maximum allowed size
@@ -217,7 +354,7 @@ class VideoDownloader:
         os.makedirs(temp_dir, exist_ok=True)
         
         try:
-            logger.info(f"Downloading video from {platform}: {url_to_download}")
+            logger.info("Downloading video from {}: {}", platform, url_to_download)
             start_time = time.time()
             
             # Special handling for Instagram - use our custom extractor
@@ -227,85 +364,83 @@ class VideoDownloader:
                 
                 if success:
                     # Check file size
-                    file_size_mb = os.path.getsize(temp_filepath) / (1024 * 1024)
+                    size_bytes = os.stat(temp_filepath).st_size
+                    file_size_mb = size_bytes / (1024 * 1024)
                     if file_size_mb > MAX_FILE_SIZE:
                         logger.warning(f"File size ({file_size_mb:.2f}MB) exceeds maximum allowed size ({MAX_FILE_SIZE}MB)")
                         os.remove(temp_filepath)
                         raise ValueError(f"Video is too large ({file_size_mb:.2f}MB). Maximum allowed size is {MAX_FILE_SIZE}MB.")
                     
                     download_time = time.time() - start_time
-                    logger.info(f"Download completed in {download_time:.2f}s. Size: {file_size_mb:.2f}MB")
-                    return temp_filepath
+                    logger.info("Download completed in {:.2f}s. Size: {:.2f}MB", download_time, file_size_mb)
+                    return DownloadResult(temp_filepath, size_bytes, "instagram_custom")
                 else:
                     # If custom extractor fails, fall back to yt-dlp
                     logger.info("Custom Instagram extractor failed, falling back to yt-dlp")
             
             # For other platforms or if Instagram custom extractor failed, use yt-dlp
-            # Get platform-specific options
-            ydl_opts = self._get_platform_options(platform)
-            
-            # Set output template to temp directory
-            ydl_opts['outtmpl'] = os.path.join(temp_dir, f"{platform}_{os.path.basename(temp_filepath)}")
+            ydl_key = platform if platform in self._ydl_pools else "default"
             
             # Special handling for Instagram URLs with yt-dlp
             if platform == "instagram":
                 # Try to convert Instagram URL to a more direct format
                 if "instagram.com/reel/" in url_to_download or "instagram.com/p/" in url_to_download:
                     # Extract the media ID
-                    import re
-                    media_id = re.search(r'/(reel|p)/([^/?]+)', url_to_download)
-                    if media_id and len(media_id.groups()) >= 2:
+                    m = _IG_URL_RE.search(url_to_download)
+                    if m:
                         # Create a more direct URL format
-                        direct_url = f"https://www.instagram.com/{media_id.group(1)}/{media_id.group(2)}/"
-                        logger.info(f"Using direct Instagram URL: {direct_url}")
+                        direct_url = f"https://www.instagram.com/{m.group(1)}/{m.group(2)}/"
+                        logger.info("Using direct Instagram URL: {}", direct_url)
                         url_to_download = direct_url
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                # Use timeout version of download
-                info = self._download_with_timeout(ydl, url_to_download)
-                
-                if not info:
-                    logger.error(f"Failed to extract info from {url_to_download}")
-                    return None
-                
-                # Get the downloaded file path
-                if 'requested_downloads' in info and info['requested_downloads']:
-                    downloaded_file = info['requested_downloads'][0]['filepath']
-                else:
-                    # Fallback to expected path
-                    downloaded_file = temp_filepath
-                
-                # Check if file exists
-                if not os.path.exists(downloaded_file):
-                    logger.error(f"Downloaded file not found: {downloaded_file}")
-                    # Try to find any file with the platform in the name
-                    possible_files = [f for f in os.listdir(temp_dir) if platform in f]
-                    if possible_files:
-                        # Sort by modification time to get the most recent file
-                        possible_files.sort(key=lambda x: os.path.getmtime(os.path.join(temp_dir, x)), reverse=True)
-                        downloaded_file = os.path.join(temp_dir, possible_files[0])
-                        logger.info(f"Found alternative file: {downloaded_file}")
-                    else:
-                        return None
-                
-                # Check file size
-                file_size_mb = os.path.getsize(downloaded_file) / (1024 * 1024)
-                if file_size_mb > MAX_FILE_SIZE:
-                    logger.warning(f"File size ({file_size_mb:.2f}MB) exceeds maximum allowed size ({MAX_FILE_SIZE}MB)")
-                    os.remove(downloaded_file)
-                    raise ValueError(f"Video is too large ({file_size_mb:.2f}MB). Maximum allowed size is {MAX_FILE_SIZE}MB.")
-                
-                # Ensure file has .mp4 extension
-                if not downloaded_file.endswith('.mp4'):
-                    new_filepath = f"{os.path.splitext(downloaded_file)[0]}.mp4"
-                    shutil.move(downloaded_file, new_filepath)
-                    downloaded_file = new_filepath
-                
-                download_time = time.time() - start_time
-                logger.info(f"Download completed in {download_time:.2f}s. Size: {file_size_mb:.2f}MB")
-                
-                return downloaded_file
-                
+            # The deadline starts before taking an instance, so time spent waiting counts too
+            deadline = time.monotonic() + DOWNLOAD_TIMEOUT
+            entry = self._acquire_ydl(ydl_key, deadline)
+            ydl, state = entry
+            try:
+                # Point the pooled instance at this request's output file and deadline
+                ydl.params['outtmpl']['default'] = f"{os.path.splitext(temp_filepath)[0]}.%(ext)s"
+                state['deadline'] = deadline
+                info = ydl.extract_info(url_to_download, download=True)
+            finally:
+                state['deadline'] = None
+                self._ydl_pools[ydl_key].put(entry)
+            
+            if not info:
+                logger.error(f"Failed to extract info from {url_to_download}")
+                return None
+            
+            # Get the downloaded file path reported by yt-dlp
+            if not info.get('requested_downloads'):
+                logger.error(f"yt-dlp did not report a downloaded file for {url_to_download}")
+                raise RuntimeError("Failed to download video: no file was produced.")
+            downloaded_file = info['requested_downloads'][0]['filepath']
+            
+            # Check that the file exists and get its size with a single stat
+            try:
+                size_bytes = os.stat(downloaded_file).st_size
+            except FileNotFoundError:
+                logger.error(f"Downloaded file not found: {downloaded_file}")
+                raise RuntimeError("Failed to download video: downloaded file not found.")
+            
+            # Check file size
+            file_size_mb = size_bytes / (1024 * 1024)
+            if file_size_mb > MAX_FILE_SIZE:
+                logger.warning(f"File size ({file_size_mb:.2f}MB) exceeds maximum allowed size ({MAX_FILE_SIZE}MB)")
+                os.remove(downloaded_file)
+                raise ValueError(f"Video is too large ({file_size_mb:.2f}MB). Maximum allowed size is {MAX_FILE_SIZE}MB.")
+            
+            # Ensure file has .mp4 extension
+            if not downloaded_file.endswith('.mp4'):
+                new_filepath = f"{os.path.splitext(downloaded_file)[0]}.mp4"
+                os.replace(downloaded_file, new_filepath)
+                downloaded_file = new_filepath
+            
+            download_time = time.time() - start_time
+            logger.info("Download completed in {:.2f}s. Size: {:.2f}MB", download_time, file_size_mb)
+            
+            return DownloadResult(downloaded_file, size_bytes, "ytdlp")
+            
         except DownloadTimeoutError as e:
             logger.error(f"Download timeout: {str(e)}")
             raise
@@ -313,53 +448,60 @@ class VideoDownloader:
             logger.error(f"Download error: {str(e)}")
             error_msg = str(e).lower()
             
-            if "video unavailable" in error_msg:
-                raise Exception("This video is no longer available or is private.")
-            elif "not available in your country" in error_msg:
-                raise Exception("This video is geo-restricted and not available in the bot's region.")
-            elif "ffmpeg is not installed" in error_msg:
-                raise Exception("FFmpeg is not properly installed. Please restart your terminal or install FFmpeg.")
-            elif "unable to download webpage" in error_msg or "http error" in error_msg:
-                raise Exception("Network error while downloading. Please try again later.")
-            elif "unsupported url" in error_msg:
-                raise Exception("This URL is not supported. Please try a direct link to the video.")
-            elif "sign in to confirm your age" in error_msg or "age-restricted" in error_msg:
-                raise Exception("This video is age-restricted and cannot be downloaded.")
-            elif "private video" in error_msg:
-                raise Exception("This video is private and cannot be downloaded.")
-            elif "login required" in error_msg or "requires authentication" in error_msg:
-                if platform == "instagram":
-                    raise Exception("This Instagram content requires login. Try using a public Instagram video.")
-                elif platform == "tiktok":
-                    raise Exception("This TikTok content requires login. Try using a public TikTok video.")
-                else:
-                    raise Exception("This content requires login and cannot be downloaded.")
-            elif "could not copy chrome cookie database" in error_msg:
-                if platform == "instagram":
-                    raise Exception("Could not access Instagram content. Try using a different Instagram link format.")
-                elif platform == "tiktok":
-                    raise Exception("Could not access TikTok content. Try using a different TikTok link format.")
-                else:
-                    raise Exception("Could not access browser cookies. Try using a different link format.")
-            else:
-                raise Exception(f"Failed to download video: {str(e)}")
+            category = next((c for substring, c in _ERR_TABLE if substring in error_msg), None)
+            message = _ERR_MESSAGES.get((category, platform), _ERR_MESSAGES.get((category, None)))
+            raise Exception(message or f"Failed to download video: {str(e)}")
         except Exception as e:
             logger.error(f"Error downloading video: {str(e)}")
             raise
             
-    def get_video_info(self, url):
+    def get_video_info(self, url, platform="default"):
         """
-        Get video information without downloading
+        Get video information without downloading, using the platform's pooled
+        info-only instances so format selection and headers match an actual download
         
         Args:
             url (str): URL to get info from
+            platform (str): Platform name (youtube, tiktok, instagram, vk)
             
         Returns:
             dict: Video information or None if extraction failed
         """
+        ydl_key = platform if platform in self._ydl_pools else "default"
         try:
-            with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}) as ydl:
-                return ydl.extract_info(url, download=False)
+            entry = self._acquire_ydl(ydl_key, time.monotonic() + DOWNLOAD_TIMEOUT, info=True)
+            try:
+                return entry[0].extract_info(url, download=False)
+            finally:
+                self._info_pools[ydl_key].put(entry)
         except Exception as e:
             logger.error(f"Error extracting video info: {str(e)}")
-            return None 
\ No newline at end of file
+            return None
+    
+    def get_direct_url(self, url, platform="default"):
+        """
+        Get a direct MP4 URL that Telegram can fetch by itself, without downloading
+        
+        Args:
+            url (str): URL of the video page
+            platform (str): Platform name (youtube, tiktok, instagram, vk)
+            
+        Returns:
+            str: Direct URL of a progressive MP4 file or None if there is no suitable one
+        """
+        info = self.get_video_info(url, platform)
+        if not info:
+            return None
+        
+        # Single file with both audio and video, served over plain HTTP(S)
+        if info.get('ext') != 'mp4' or info.get('protocol') not in ('http', 'https'):
+            return None
+        if info.get('vcodec') == 'none' or info.get('acodec') == 'none':
+            return None
+        
+        # Telegram rejects larger files sent by URL, skip the round-trip when the size is known
+        size = info.get('filesize') or info.get('filesize_approx')
+        if size and size > MAX_URL_UPLOAD_SIZE:
+            return None
+        
+        return info.get('url')
\ No newline at end of file
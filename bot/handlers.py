@@ -8,19 +8,30 @@ Last Modified: 2024-02-27
 
 import os
 import asyncio
+import functools
 import traceback
+import concurrent.futures
 from loguru import logger
-from aiogram import types, Router
+from aiogram import types, Router, F
 from aiogram.filters import Command
 from aiogram.exceptions import TelegramAPIError
 
-from .utils import contains_video_link, extract_video_id, clean_temp_files, is_valid_video_file
-from .downloader import VideoDownloader, DownloadTimeoutError
+from .utils import match_link, clean_temp_files, is_valid_video_file
+from .downloader import VideoDownloader, DownloadTimeoutError, DOWNLOAD_WORKERS
 
 # Initialize video downloader
 downloader = VideoDownloader()
 router = Router()
 
+# Thread pool for blocking download and file operations, keeps the event loop responsive
+_DL_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS)
+
+# Read size for streaming uploads (aiogram's default is 64KB, each read is a thread-pool hop)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# References to fire-and-forget cleanup tasks, so they aren't garbage collected mid-run
+_background_tasks = set()
+
 async def on_startup(bot):
     """
     Actions to perform on bot startup
@@ -39,9 +50,15 @@ async def on_shutdown(bot):
         bot: Bot instance
     """
     logger.info("Bot shutting down")
+    # Let pending cleanups finish, then wait for running downloads off the event loop,
+    # so nothing still uses the pool or the downloader once they are closed
+    if _background_tasks:
+        await asyncio.gather(*_background_tasks, return_exceptions=True)
+    await asyncio.get_running_loop().run_in_executor(None, functools.partial(_DL_POOL.shutdown, wait=True))
+    downloader.close()
     clean_temp_files()
 
-@router.message(lambda message: message.text and len(message.text) > 10 and contains_video_link(message.text))
+@router.message(F.text)
 async def process_message(message: types.Message):
     """
     Process incoming message and check for video links
@@ -49,15 +66,10 @@ async def process_message(message: types.Message):
     Args:
         message (types.Message): Telegram message
     """
-    # Extract video URL from message
-    urls = message.text.split()
-    for url in urls:
-        platform, video_id = extract_video_id(url)
-        
-        if platform and video_id:
-            await process_video_link(message, url, platform, video_id)
-            # Only process the first valid video link
-            break
+    # Only process the first valid video link, found in a single scan of the text
+    video = match_link(message.text)
+    if video:
+        await process_video_link(message, *video)
 
 async def process_video_link(message: types.Message, url: str, platform: str, video_id: str):
     """
@@ -71,76 +83,74 @@ async def process_video_link(message: types.Message, url: str, platform: str, vi
     """
     chat_id = message.chat.id
     message_id = message.message_id
+    loop = asyncio.get_running_loop()
     
     # Get sender information
     sender_name = get_sender_name(message)
     
     # Send "processing" message
-    processing_msg = await message.reply("⏳ Processing video...")
-    
-    # Update processing message periodically to show progress
-    stop_progress_updates = False
-    
-    async def update_progress():
-        progress_states = ["⏳ Processing video.", "⏳ Processing video..", "⏳ Processing video..."]
-        i = 0
-        while not stop_progress_updates:
-            try:
-                await processing_msg.edit_text(progress_states[i % len(progress_states)])
-                i += 1
-                await asyncio.sleep(3)  # Update every 3 seconds
-            except Exception:
-                break
-    
-    # Start progress updates in background
-    progress_task = asyncio.create_task(update_progress())
+    processing_msg = await message.reply("⏬ Downloading video...")
     
     try:
-        # Download the video
-        logger.info(f"Starting download for {platform} video: {video_id}")
-        video_path = downloader.download_video(url, platform, video_id)
-        logger.info(f"Download completed, file path: {video_path}")
+        # Let Telegram fetch the video by itself when there is a direct URL.
+        # YouTube and Instagram are skipped, their CDN URLs are bound to the
+        # requesting client and Telegram can't fetch them.
+        if platform not in ("youtube", "instagram"):
+            direct_url = await loop.run_in_executor(_DL_POOL, downloader.get_direct_url, url, platform)
+            if direct_url:
+                try:
+                    await message.reply_video(
+                        video=direct_url,
+                        caption=f"Shared by: {sender_name}",
+                        supports_streaming=True
+                    )
+                    logger.info("Video sent by direct URL")
+                    schedule_cleanup(message, processing_msg)
+                    return
+                except TelegramAPIError as api_error:
+                    logger.warning(f"Telegram could not fetch direct URL, downloading instead: {api_error}")
         
-        # Stop progress updates
-        stop_progress_updates = True
-        try:
-            await progress_task
-        except Exception as e:
-            logger.error(f"Error stopping progress task: {e}")
+        # Download the video
+        logger.info("Starting download for {} video: {}", platform, video_id)
+        result = await loop.run_in_executor(_DL_POOL, downloader.download_video, url, platform, video_id)
         
-        if not video_path or not os.path.exists(video_path):
-            logger.error(f"Video file not found after download: {video_path}")
+        if not result:
+            logger.error(f"No video file after download: {url}")
             await processing_msg.edit_text("❌ Failed to download video. The video might be unavailable or private.")
             return
         
-        # Verify the video file is valid
-        if not is_valid_video_file(video_path):
+        video_path = result.path
+        logger.info("Download completed, file path: {}", video_path)
+        
+        # Verify the video file is valid. yt-dlp already produced a proper container,
+        # only files from the custom Instagram extractor need probing.
+        if result.source == "instagram_custom" and not await loop.run_in_executor(_DL_POOL, is_valid_video_file, video_path):
             logger.error(f"Invalid video file: {video_path}")
             await processing_msg.edit_text("❌ The downloaded file is not a valid video. Please try a different video.")
             try:
-                os.remove(video_path)
+                await remove_file(video_path)
             except Exception:
                 pass
             return
         
         # Log file details
-        file_size_mb = os.path.getsize(video_path) / (1024 * 1024)
-        logger.info(f"Sending video file: {video_path}, Size: {file_size_mb:.2f}MB")
+        file_size_mb = result.size_bytes / (1024 * 1024)
+        logger.info("Sending video file: {}, Size: {:.2f}MB", video_path, file_size_mb)
         
         # Send the video with better error handling
         try:
-            with open(video_path, 'rb') as video_file:
-                logger.info("Sending video to Telegram...")
-                # Use InputFile to ensure proper file handling
-                await message.reply_video(
-                    video=types.BufferedInputFile(
-                        video_file.read(),
-                        filename=f"{platform}_{video_id}.mp4"
-                    ),
-                    caption=f"Shared by: {sender_name}",
-                    supports_streaming=True
-                )
-                logger.info("Video sent successfully")
+            logger.info("Sending video to Telegram...")
+            # Stream the file from disk instead of reading it into memory
+            await message.reply_video(
+                video=types.FSInputFile(
+                    video_path,
+                    filename=f"{platform}_{video_id}.mp4",
+                    chunk_size=UPLOAD_CHUNK_SIZE
+                ),
+                caption=f"Shared by: {sender_name}",
+                supports_streaming=True
+            )
+            logger.info("Video sent successfully")
         except TelegramAPIError as api_error:
             logger.error(f"Telegram API error when sending video: {api_error}")
             await processing_msg.edit_text(f"❌ Error sending video: {str(api_error)}")
@@ -150,62 +160,80 @@ async def process_video_link(message: types.Message, url: str, platform: str, vi
             await processing_msg.edit_text(f"❌ Error sending video: {str(send_error)}")
             return
         
-        # Delete the original message
-        try:
-            await message.delete()
-            logger.info("Original message deleted")
-        except Exception as e:
-            logger.error(f"Failed to delete original message: {e}")
-        
-        # Delete the processing message
-        try:
-            await processing_msg.delete()
-            logger.info("Processing message deleted")
-        except Exception as e:
-            logger.error(f"Failed to delete processing message: {e}")
-        
-        # Clean up the downloaded file
-        try:
-            os.remove(video_path)
-            logger.debug(f"Removed temporary file: {video_path}")
-        except Exception as e:
-            logger.error(f"Failed to remove temporary file: {e}")
+        # Clean up in the background so the handler returns as soon as the video is sent
+        schedule_cleanup(message, processing_msg, video_path)
             
     except DownloadTimeoutError as e:
-        # Stop progress updates
-        stop_progress_updates = True
-        try:
-            await progress_task
-        except Exception:
-            pass
-        
         # Download timeout
         logger.error(f"Download timeout: {e}")
         await processing_msg.edit_text(f"❌ {str(e)}")
     except ValueError as e:
-        # Stop progress updates
-        stop_progress_updates = True
-        try:
-            await progress_task
-        except Exception:
-            pass
-        
         # File size exceeded
         logger.error(f"Value error: {e}")
         await processing_msg.edit_text(f"❌ {str(e)}")
     except Exception as e:
-        # Stop progress updates
-        stop_progress_updates = True
-        try:
-            await progress_task
-        except Exception:
-            pass
-        
         # Other errors
         error_message = str(e) if str(e) else "An unknown error occurred"
         logger.error(f"Error processing video: {e}\n{traceback.format_exc()}")
         await processing_msg.edit_text(f"❌ {error_message}")
 
+def schedule_cleanup(message: types.Message, processing_msg: types.Message, video_path: str = None):
+    """
+    Run cleanup_after_send as a background task
+    
+    Args:
+        message (types.Message): Original message with the link
+        processing_msg (types.Message): Status message sent by the bot
+        video_path (str): Path to the downloaded video file, None if nothing was downloaded
+    """
+    task = asyncio.create_task(cleanup_after_send(message, processing_msg, video_path))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def cleanup_after_send(message: types.Message, processing_msg: types.Message, video_path: str = None):
+    """
+    Delete the original and processing messages and the downloaded file concurrently
+    
+    Args:
+        message (types.Message): Original message with the link
+        processing_msg (types.Message): Status message sent by the bot
+        video_path (str): Path to the downloaded video file, None if nothing was downloaded
+    """
+    original_result, processing_result, remove_result = await asyncio.gather(
+        message.delete(),
+        processing_msg.delete(),
+        remove_file(video_path) if video_path else asyncio.sleep(0),
+        return_exceptions=True
+    )
+    
+    if isinstance(original_result, Exception):
+        logger.error(f"Failed to delete original message: {original_result}")
+    else:
+        logger.info("Original message deleted")
+    
+    if isinstance(processing_result, Exception):
+        logger.error(f"Failed to delete processing message: {processing_result}")
+    else:
+        logger.info("Processing message deleted")
+    
+    if isinstance(remove_result, Exception):
+        logger.error(f"Failed to remove temporary file: {remove_result}")
+    elif video_path:
+        logger.debug("Removed temporary file: {}", video_path)
+
+async def remove_file(path: str):
+    """
+    Remove a file on the download pool, or inline once the pool has been shut down
+    
+    Args:
+        path (str): Path to the file to remove
+    """
+    try:
+        await asyncio.get_running_loop().run_in_executor(_DL_POOL, os.remove, path)
+    except RuntimeError:
+        # Cannot schedule new futures after shutdown
+        os.remove(path)
+
 def get_sender_name(message: types.Message) -> str:
     """
     Get the name of the message sender
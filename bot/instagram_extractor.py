@@ -9,18 +9,47 @@ Last Modified: 2024-02-27
 import os
 import re
 import json
+import shutil
 import requests
+from requests.adapters import HTTPAdapter
 from loguru import logger
 
+# Patterns for finding the video URL in an Instagram page
+_VIDEO_URL_RE = re.compile(rb'"video_url":"([^"]+)"')
+_SHARED_DATA_RE = re.compile(r'<script type="text/javascript">window\._sharedData = (.+?);</script>')
+_ADDITIONAL_DATA_RE = re.compile(r'<script type="text/javascript">window\.__additionalDataLoaded\(\'[^\']+\',(.+?)\);</script>')
+
+# Read size when streaming a page, and how much of the previous chunk is searched again
+# so a "video_url" entry split across two chunks is still found
+PAGE_CHUNK_SIZE = 64 * 1024
+PAGE_CHUNK_OVERLAP = 8 * 1024
+
+# Read size and file write buffer size when downloading videos
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_BUFFER_SIZE = 4 * 1024 * 1024
+
 class InstagramExtractor:
     """
     Custom Instagram video extractor that doesn't rely on cookies
+    
+    The extractor is synchronous. It is called from VideoDownloader.download_video,
+    which the handlers run on a thread pool, so its requests don't block the event loop.
     """
     
-    def __init__(self):
+    def __init__(self, session=None):
         """
         Initialize the Instagram extractor
+        
+        Args:
+            session (requests.Session): Shared HTTP session to reuse connections (optional)
         """
+        # Without a shared session, keep a pooled one of our own so the oEmbed, page
+        # and video requests reuse the same keep-alive connections
+        self._owns_session = session is None
+        if self._owns_session:
+            session = requests.Session()
+            session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+        self.session = session
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
@@ -46,7 +75,7 @@ class InstagramExtractor:
             
             # Try to use the Instagram oEmbed API first
             oembed_url = f"https://api.instagram.com/oembed/?url={instagram_url}"
-            response = requests.get(oembed_url, headers=self.headers, timeout=10)
+            response = self.session.get(oembed_url, headers=self.headers, timeout=10)
             
             if response.status_code == 200:
                 logger.info("Successfully accessed Instagram oEmbed API")
@@ -59,22 +88,14 @@ class InstagramExtractor:
                     # This would require additional API calls that might need authentication
             
             # If oEmbed doesn't work, try to scrape the page
-            response = requests.get(instagram_url, headers=self.headers, timeout=10)
+            video_url, html_content = self._scan_page(instagram_url)
+            if video_url:
+                logger.info(f"Found video URL: {video_url}")
+                return video_url
             
-            if response.status_code == 200:
-                html_content = response.text
-                
-                # Try to find the video URL in the page
-                # Look for video URLs in the page
-                video_urls = re.findall(r'\"video_url\":\"([^\"]+)\"', html_content)
-                if video_urls:
-                    # Unescape the URL
-                    video_url = video_urls[0].replace('\\u0026', '&')
-                    logger.info(f"Found video URL: {video_url}")
-                    return video_url
-                
+            if html_content is not None:
                 # Try to find the shared data JSON
-                shared_data_match = re.search(r'<script type="text/javascript">window\._sharedData = (.+?);</script>', html_content)
+                shared_data_match = _SHARED_DATA_RE.search(html_content)
                 if shared_data_match:
                     shared_data = json.loads(shared_data_match.group(1))
                     
@@ -90,7 +111,7 @@ class InstagramExtractor:
                         logger.error(f"Error parsing shared data: {e}")
                 
                 # Try to find additional data in the page
-                additional_data_match = re.search(r'<script type="text/javascript">window\.__additionalDataLoaded\(\'[^\']+\',(.+?)\);</script>', html_content)
+                additional_data_match = _ADDITIONAL_DATA_RE.search(html_content)
                 if additional_data_match:
                     try:
                         additional_data = json.loads(additional_data_match.group(1))
@@ -110,6 +131,34 @@ class InstagramExtractor:
             logger.error(f"Error extracting Instagram video URL: {e}")
             return None
     
+    def _scan_page(self, url):
+        """
+        Stream an Instagram page and stop as soon as a "video_url" entry is found
+        
+        Args:
+            url (str): Instagram post URL
+            
+        Returns:
+            tuple: (video_url, None) if found while streaming, (None, html_content) with the
+                whole page for the JSON fallbacks otherwise, or (None, None) on HTTP errors
+        """
+        with self.session.get(url, headers=self.headers, timeout=10, stream=True) as response:
+            if response.status_code != 200:
+                return None, None
+            
+            chunks = []
+            tail = b''
+            for chunk in response.iter_content(chunk_size=PAGE_CHUNK_SIZE):
+                window = tail + chunk
+                match = _VIDEO_URL_RE.search(window)
+                if match:
+                    # Unescape the URL
+                    return match.group(1).decode('utf-8', errors='replace').replace('\\u0026', '&'), None
+                chunks.append(chunk)
+                tail = window[-PAGE_CHUNK_OVERLAP:]
+            
+            return None, b''.join(chunks).decode(response.encoding or 'utf-8', errors='replace')
+    
     def download_video(self, instagram_url, output_path):
         """
         Download video from Instagram URL
@@ -121,6 +170,9 @@ class InstagramExtractor:
         Returns:
             bool: True if download successful, False otherwise
         """
+        # Write to a side file and only move it into place once complete, so a failed
+        # download never leaves a partial file at output_path
+        part_path = output_path + '.part'
         try:
             video_url = self.extract_video_url(instagram_url)
             if not video_url:
@@ -129,13 +181,14 @@ class InstagramExtractor:
             
             # Download the video
             logger.info(f"Downloading video from {video_url}")
-            response = requests.get(video_url, headers=self.headers, stream=True, timeout=30)
+            response = self.session.get(video_url, headers=self.headers, stream=True, timeout=30)
             
             if response.status_code == 200:
-                with open(output_path, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=1024*1024):
-                        if chunk:
-                            f.write(chunk)
+                # Pump the raw stream straight into a large write buffer
+                response.raw.decode_content = True
+                with open(part_path, 'wb', buffering=DOWNLOAD_BUFFER_SIZE) as f:
+                    shutil.copyfileobj(response.raw, f, length=DOWNLOAD_CHUNK_SIZE)
+                os.replace(part_path, output_path)
                 
                 logger.info(f"Video downloaded to {output_path}")
                 return True
@@ -145,8 +198,19 @@ class InstagramExtractor:
                 
         except Exception as e:
             logger.error(f"Error downloading Instagram video: {e}")
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
             return False
     
+    def close(self):
+        """
+        Close the HTTP session if it was created by the extractor
+        """
+        if self._owns_session:
+            self.session.close()
+    
     def _clean_url(self, url):
         """
         Clean up Instagram URL
@@ -158,7 +222,7 @@ class InstagramExtractor:
             str: Cleaned URL
         """
         # Remove query parameters
-        url = re.sub(r'\?.*$', '', url)
+        url = url.partition('?')[0]
         
         # Ensure URL ends with /
         if not url.endswith('/'):
@@ -9,35 +9,33 @@ Last Modified: 2024-02-27
 import os
 import asyncio
 from loguru import logger
-from aiogram import Bot, Dispatcher
-from aiogram.enums import ParseMode
-from aiogram.client.default import DefaultBotProperties
-from dotenv import load_dotenv
 
-from .handlers import setup_handlers, on_startup, on_shutdown
+# Importing utils also loads environment variables from .env
+from .utils import configure_logging
 
-# Load environment variables
-load_dotenv()
-
-# Get bot token from environment variables
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-if not BOT_TOKEN:
-    logger.error("No bot token provided. Please set BOT_TOKEN in .env file.")
-    exit(1)
-
-# Initialize bot and dispatcher
-bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher()
-
-# Register handlers
-setup_handlers(dp)
-
-async def main_async():
+async def main_async(bot_token):
     """
     Async main function to start the bot
+    
+    Args:
+        bot_token (str): Telegram Bot Token
     """
+    # Imported here so the handlers (and the downloader they create) are set up
+    # after logging is configured
+    from aiogram import Bot, Dispatcher
+    from aiogram.enums import ParseMode
+    from aiogram.client.default import DefaultBotProperties
+    from .handlers import setup_handlers, on_startup, on_shutdown
+    
     logger.info("Starting Telegram Video Bot...")
     
+    # Initialize bot and dispatcher
+    bot = Bot(token=bot_token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    dp = Dispatcher()
+    
+    # Register handlers
+    setup_handlers(dp)
+    
     # Set up startup and shutdown handlers
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
@@ -49,8 +47,16 @@ def main():
     """
     Main function to start the bot
     """
+    configure_logging()
+    
+    # Get bot token from environment variables
+    bot_token = os.getenv("BOT_TOKEN")
+    if not bot_token:
+        logger.error("No bot token provided. Please set BOT_TOKEN in .env file.")
+        exit(1)
+    
     try:
-        asyncio.run(main_async())
+        asyncio.run(main_async(bot_token))
     except (KeyboardInterrupt, SystemExit):
         logger.info("Bot stopped")
     except Exception as e:
@@ -8,24 +8,32 @@ Last Modified: 2024-02-27
 
 import os
 import re
+import json
+import hashlib
+import functools
 import logging
 import subprocess
 from loguru import logger
 from dotenv import load_dotenv
 
-# Load environment variables
+# Use RE2 for link detection when available: it matches in linear time, so hostile
+# message text can't trigger catastrophic backtracking. Falls back to the re module.
+try:
+    import re2 as _link_re
+except ImportError:
+    _link_re = re
+
+# Use an Aho-Corasick automaton for the domain pre-filter when pyahocorasick is available
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Load environment variables, once for the whole bot. Variables already set in
+# the environment take precedence over the .env file.
 load_dotenv()
 
-# Configure logging
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
-logger.remove()
-logger.add(
-    "bot.log",
-    level=LOG_LEVEL,
-    format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}",
-    rotation="10 MB",
-    retention="1 week",
-)
 
 # Configure standard logging to use loguru
 class InterceptHandler(logging.Handler):
@@ -33,12 +41,29 @@ class InterceptHandler(logging.Handler):
         logger_opt = logger.opt(depth=6, exception=record.exc_info)
         logger_opt.log(record.levelname, record.getMessage())
 
-logging.basicConfig(handlers=[InterceptHandler()], level=LOG_LEVEL)
+def configure_logging():
+    """
+    Configure the log file sink and route standard logging through loguru.
+    Called once at startup, so importing this module doesn't open any files.
+    """
+    logger.remove()
+    logger.add(
+        "bot.log",
+        level=LOG_LEVEL,
+        format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}",
+        rotation="10 MB",
+        retention="1 week",
+    )
+    logging.basicConfig(handlers=[InterceptHandler()], level=LOG_LEVEL)
 
 # Constants
 MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", 50))  # in MB
 DOWNLOAD_DIR = os.getenv("DOWNLOAD_DIR", "bot/downloads")
 TARGET_QUALITY = os.getenv("TARGET_QUALITY", "720")
+SPEED_PROFILE = os.getenv("SPEED_PROFILE", "balanced").lower()
+
+# Video file extensions accepted by is_valid_video_file
+VALID_VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.webm')
 
 # Create downloads directory if it doesn't exist
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
@@ -47,11 +72,54 @@ os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 YOUTUBE_SHORTS_REGEX = r'(?:https?:\/\/)?(?:www\.)?(?:youtube\.com\/(?:shorts\/|watch\?v=)|youtu\.be\/)([\w-]{11})'
 TIKTOK_REGEX = r'(?:https?:\/\/)?(?:www\.|vt\.)?(?:tiktok\.com\/(?:@[\w.-]+\/video\/|@[\w.-]+\/|[\w.-]+\/|v\/)?)([\w.-]+)'
 INSTAGRAM_REELS_REGEX = r'(?:https?:\/\/)?(?:www\.)?(?:instagram\.com\/(?:reel|p|reels|stories)\/)([\w-]+)(?:\/|\?.*)?'
-VK_REGEX = r'(?:https?:\/\/)?(?:www\.)?(?:vk\.com\/(?:feed\?z=clip-|video-|clip|video|wall-|wall|feed\?w=wall-|feed\?w=clip-|feed\?.*clip-|feed\?.*video-))?([\w.-]+)'
+VK_REGEX = r'(?:https?:\/\/)?(?:www\.)?(?:vk\.com\/(?:feed\?z=clip-|video-|clip|video|wall-|wall|feed\?w=wall-|feed\?w=clip-|feed\?.*clip-|feed\?.*video-)?)([\w.-]+)'
+
+# All platform patterns fused into one precompiled alternation, so a text is scanned once.
+# Each platform is a named group, the match's lastgroup tells which one matched.
+_PLATFORM_PATTERNS = (
+    ("youtube", YOUTUBE_SHORTS_REGEX),
+    ("tiktok", TIKTOK_REGEX),
+    ("instagram", INSTAGRAM_REELS_REGEX),
+    ("vk", VK_REGEX),
+)
+_COMBINED_RE = _link_re.compile("|".join(f"(?P<{name}>{pattern})" for name, pattern in _PLATFORM_PATTERNS))
+
+# Any link to a supported platform, used to locate candidate URLs in a message in one pass.
+# The subdomain prefix is bounded so long dotted runs of text cannot backtrack quadratically
+_VIDEO_URL_RE = _link_re.compile(r'(?i)(?:https?:\/\/)?(?:[\w-]{1,63}\.){0,2}(?:youtube\.com|youtu\.be|tiktok\.com|instagram\.com|vk\.com)\/\S+')
+
+# Literal domain fragments every supported link contains. Texts without any of them
+# are rejected before a regex runs.
+_DOMAIN_TOKENS = ("youtu", "tiktok", "instagr", "vk.com")
+
+if ahocorasick is not None:
+    _DOMAIN_AUTOMATON = ahocorasick.Automaton()
+    for _token in _DOMAIN_TOKENS:
+        _DOMAIN_AUTOMATON.add_word(_token, _token)
+    _DOMAIN_AUTOMATON.make_automaton()
+else:
+    _DOMAIN_AUTOMATON = None
+
+def _has_domain_token(text):
+    """
+    Check if text mentions any supported platform domain, in a single pass when possible
+    
+    Args:
+        text (str): Text to check
+        
+    Returns:
+        bool: True if text contains a supported domain fragment, False otherwise
+    """
+    lowered = text.lower()
+    if _DOMAIN_AUTOMATON is not None:
+        return next(_DOMAIN_AUTOMATON.iter(lowered), None) is not None
+    return any(token in lowered for token in _DOMAIN_TOKENS)
 
+@functools.lru_cache(maxsize=4096)
 def extract_video_id(url):
     """
-    Extract video ID from supported platform URLs
+    Extract video ID from supported platform URLs. Results are cached, links
+    are often re-shared in the same chats.
     
     Args:
         url (str): URL to extract video ID from
@@ -59,30 +127,39 @@ def extract_video_id(url):
     Returns:
         tuple: (platform, video_id) or (None, None) if not supported
     """
-    # Check YouTube Shorts/Videos
-    youtube_match = re.search(YOUTUBE_SHORTS_REGEX, url)
-    if youtube_match:
-        return "youtube", youtube_match.group(1)
+    match = _COMBINED_RE.search(url)
+    if not match:
+        return None, None
     
-    # Check TikTok
-    tiktok_match = re.search(TIKTOK_REGEX, url)
-    if tiktok_match:
-        # For TikTok, we'll use the full URL as the ID might be complex
-        return "tiktok", url
+    platform = match.lastgroup
+    if platform == "youtube":
+        # The video ID is the group right after the platform's named group
+        return platform, match.group(_COMBINED_RE.groupindex[platform] + 1)
     
-    # Check Instagram Reels
-    instagram_match = re.search(INSTAGRAM_REELS_REGEX, url)
-    if instagram_match:
-        # For Instagram, we'll use the full URL as the ID might not be sufficient
-        return "instagram", url
+    # For TikTok, Instagram and VK, we'll use the full URL as the ID might not be sufficient
+    return platform, url
+
+def match_link(text):
+    """
+    Find the first supported video link in a message. Shared by the handlers and
+    contains_video_link, so a message only goes through link detection once.
     
-    # Check VK videos
-    vk_match = re.search(VK_REGEX, url)
-    if vk_match:
-        # For VK, we'll use the full URL
-        return "vk", url
+    Args:
+        text (str): Message text to search
+        
+    Returns:
+        tuple: (url, platform, video_id) or None if text has no supported link
+    """
+    if not text or not _has_domain_token(text):
+        return None
     
-    return None, None
+    for match in _VIDEO_URL_RE.finditer(text):
+        url = match.group(0)
+        platform, video_id = extract_video_id(url)
+        if platform and video_id:
+            return url, platform, video_id
+    
+    return None
 
 def contains_video_link(text):
     """
@@ -94,26 +171,7 @@ def contains_video_link(text):
     Returns:
         bool: True if text contains supported video link, False otherwise
     """
-    if not text:
-        return False
-    
-    # First, check if the text contains "http" or "www" to quickly filter out non-links
-    if not ("http" in text.lower() or "www" in text.lower()):
-        return False
-        
-    patterns = [YOUTUBE_SHORTS_REGEX, TIKTOK_REGEX, INSTAGRAM_REELS_REGEX, VK_REGEX]
-    
-    for pattern in patterns:
-        if re.search(pattern, text):
-            # Extract the match to verify it's a valid URL
-            match = re.search(pattern, text)
-            if match:
-                # Check if the matched text is substantial (not just a few characters)
-                matched_text = match.group(0)
-                if len(matched_text) > 10:  # A reasonable URL should be longer than 10 chars
-                    return True
-    
-    return False
+    return match_link(text) is not None
 
 def get_temp_filepath(platform, video_id):
     """
@@ -128,13 +186,49 @@ def get_temp_filepath(platform, video_id):
     """
     # For platforms where we use the full URL as ID, create a hash
     if platform in ["tiktok", "instagram", "vk"]:
-        import hashlib
-        # Create a hash of the URL to use as filename
-        hash_object = hashlib.md5(video_id.encode())
-        video_id = hash_object.hexdigest()[:15]  # Use first 15 chars of hash
+        # Create a short hash of the URL to use as filename
+        video_id = hashlib.blake2b(video_id.encode(), digest_size=8).hexdigest()
     
     return os.path.join(DOWNLOAD_DIR, f"{platform}_{video_id}.mp4")
 
+@functools.lru_cache(maxsize=256)
+def _probe_video(file_path, size, mtime_ns):
+    """
+    Run ffprobe on a file, cached by path, size and modification time
+    
+    Args:
+        file_path (str): Path to the file to check
+        size (int): File size in bytes, part of the cache key
+        mtime_ns (int): File modification time in nanoseconds, part of the cache key
+        
+    Returns:
+        bool: True if the file has a readable video stream, False otherwise
+        
+    Raises:
+        subprocess.TimeoutExpired: If ffprobe takes too long (not cached)
+        Exception: If ffprobe can't be run (not cached)
+    """
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-analyzeduration', '1000000', '-probesize', '1000000',
+         '-select_streams', 'v:0', '-show_entries', 'stream=codec_type', '-of', 'json', file_path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        timeout=5
+    )
+    # ffprobe exits with an error for unreadable or corrupt files
+    if result.returncode != 0:
+        logger.error(f"FFprobe reports invalid video data: {file_path}")
+        return False
+    
+    # Check if file contains video stream
+    streams = json.loads(result.stdout).get('streams') or []
+    if not streams or streams[0].get('codec_type') != 'video':
+        logger.error(f"No video stream found in file: {file_path}")
+        return False
+        
+    return True
+
 def is_valid_video_file(file_path):
     """
     Check if a file is a valid video file
@@ -145,48 +239,31 @@ def is_valid_video_file(file_path):
     Returns:
         bool: True if file is a valid video, False otherwise
     """
-    if not os.path.exists(file_path):
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
         logger.error(f"File does not exist: {file_path}")
         return False
     
     # Check file size
-    file_size = os.path.getsize(file_path)
-    if file_size == 0:
+    if st.st_size == 0:
         logger.error(f"File is empty: {file_path}")
         return False
     
     # Check file extension
-    valid_extensions = ['.mp4', '.mov', '.avi', '.mkv', '.webm']
-    if not any(file_path.lower().endswith(ext) for ext in valid_extensions):
+    if not file_path.lower().endswith(VALID_VIDEO_EXTENSIONS):
         logger.error(f"File has invalid extension: {file_path}")
         return False
     
-    # Try to get video info using ffmpeg
+    # Try to get the first video stream using ffprobe, unchanged files are only probed once
     try:
-        result = subprocess.run(
-            ['ffmpeg', '-i', file_path, '-hide_banner'],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            timeout=5
-        )
-        # ffmpeg outputs to stderr for file info
-        if "Invalid data found" in result.stderr or "Error" in result.stderr:
-            logger.error(f"FFmpeg reports invalid video data: {file_path}")
-            return False
-        
-        # Check if file contains video stream
-        if "Video:" not in result.stderr:
-            logger.error(f"No video stream found in file: {file_path}")
-            return False
-            
-        return True
+        return _probe_video(file_path, st.st_size, st.st_mtime_ns)
     except subprocess.TimeoutExpired:
         logger.error(f"Timeout checking video file: {file_path}")
         return False
     except Exception as e:
         logger.error(f"Error checking video file: {file_path}, Error: {e}")
-        # If we can't check with ffmpeg, assume it's valid
+        # If we can't check with ffprobe, assume it's valid
         return True
 
 def clean_temp_files():
@@ -194,10 +271,11 @@ def clean_temp_files():
     Remove all temporary files from download directory
     """
     try:
-        for file in os.listdir(DOWNLOAD_DIR):
-            file_path = os.path.join(DOWNLOAD_DIR, file)
-            if os.path.isfile(file_path):
-                os.remove(file_path)
-                logger.debug(f"Removed temporary file: {file_path}")
+        # DirEntry carries the file type from the directory listing, no extra stat per file
+        with os.scandir(DOWNLOAD_DIR) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    os.unlink(entry.path)
+                    logger.debug("Removed temporary file: {}", entry.path)
     except Exception as e:
         logger.error(f"Error cleaning temporary files: {e}") 
\ No newline at end of file
@@ -23,10 +23,11 @@ def find_ffmpeg():
                                stdout=subprocess.PIPE, 
                                stderr=subprocess.PIPE, 
                                text=True, 
-                               shell=True)
+                               timeout=5)
         if result.returncode == 0:
             print("✅ FFmpeg found in PATH")
-            print(f"Version info: {result.stdout.splitlines()[0]}")
+            version_line = result.stdout.partition('\n')[0]
+            print(f"Version info: {version_line}")
             return 'ffmpeg'
     except Exception as e:
         print(f"❌ Error checking FFmpeg in PATH: {e}")
@@ -46,8 +47,10 @@ def find_ffmpeg():
                 result = subprocess.run([path, '-version'], 
                                       stdout=subprocess.PIPE, 
                                       stderr=subprocess.PIPE, 
-                                      text=True)
-                print(f"Version info: {result.stdout.splitlines()[0]}")
+                                      text=True,
+                                      timeout=5)
+                version_line = result.stdout.partition('\n')[0]
+                print(f"Version info: {version_line}")
             except Exception as e:
                 print(f"❌ Error running FFmpeg: {e}")
             return path